@@ -1,20 +1,56 @@
 # -----------------External Import-----------------
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END, MessagesState
-from langchain_huggingface import ChatHuggingFace
 from langchain_core.prompts import PromptTemplate
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, ToolMessage
-import json
-import random
+from langchain_core.messages import AIMessage, ToolMessage
+import itertools
+import orjson
+import re
+import threading
+from functools import lru_cache
 from typing import Literal
 
 # -----------------Internal Import-----------------
-from agents.generation_agent import get_hugface_model
+from agents.generation_agent import ChatLLM, get_hugface_model, run_chat
 from agents.transcript_agent import VoiceToText
 from agents.video_agent import SmolVLM2ChatModel
 from agents.memory import MemoryManager
 from agents.tools import generate_report, clean_think_blocks, extract_assistant_response
 from agents.prompt_template import supervisor_system_prompt_3, report_system_prompt_1
 
+# Decorative wrappers around agent output, shared across calls and rotated in turn
+_AI_RESPONSES = (
+    "✅ Got it! Here's what I came up with: 👇\n{text}",
+    "💡 Sure thing! Take a look at this: 👇\n{text}",
+    "👍 No worries — here’s my response: 👇\n{text}",
+    "✨ Here’s what I’ve prepared for you: 👇\n{text}",
+    "🤖 Absolutely! Here’s the result: 👇\n{text}",
+    "👌 Sure! This is what I found: 👇\n{text}",
+    "🚀 Done! Here’s my output: 👇\n{text}",
+    "🧠 Here’s my take on that: 👇\n{text}",
+    "📘 Here’s the information you asked for: 👇\n{text}",
+    "✅ All set! Check out my answer below: 👇\n{text}",
+)
+_SUCCESS_RESPONSES = (
+    "✨ Sure! Your request has been completed successfully ✅",
+    "✅ Done! Everything went smoothly ✨",
+    "🎯 Request processed successfully — all set!",
+    "👍 Got it! Your request was handled perfectly ✅",
+    "🚀 Success! The task is now complete ✨",
+    "🌟 All done — your request went through successfully ✅",
+    "💪 Mission accomplished! Everything’s done as requested ✨",
+    "🧩 Your request was processed with no issues ✅",
+    "🎉 Great! Everything has been completed successfully ✨",
+    "✅ All set! Your request finished without any errors 🌟",
+)
+_ai_response_cycle = itertools.cycle(_AI_RESPONSES)
+_success_response_cycle = itertools.cycle(_SUCCESS_RESPONSES)
+
+# Sliding window over the chat history fed to the report prompt. Keeping the prompt
+# bounded keeps the KV cache bounded as well.
+CHAT_HISTORY_TOP_K = 4
+CHAT_HISTORY_MAX_TOKENS = 1024
+
 # Define a state that inherit from 'MessagesState', 'MessagesState' has a key value called "messages" that can store a list of message conversation
 class GraphState(MessagesState):
     user_id: str
@@ -25,7 +61,7 @@ class GraphState(MessagesState):
     report_path: str
     chat_history: str
 
-    hug_llm: ChatHuggingFace
+    hug_llm: ChatLLM
     transcript_model: VoiceToText
     vlm: SmolVLM2ChatModel
     memory: MemoryManager
@@ -54,7 +90,7 @@ def load_memory(state: GraphState):
     chat_history = memory.get_context(
         user_id=user_id,
         session_id=session_id,
-        top_k=8    
+        top_k=CHAT_HISTORY_TOP_K
     )
     print(f"-----Chat History-----")
     print(f"{chat_history}")
@@ -71,15 +107,10 @@ def orchestrator(state: GraphState):
     user_query = state["user_query"]
     llm_model = state["hug_llm"]
 
-    messages = [
-        SystemMessage(content=supervisor_system_prompt_3),
-        HumanMessage(content=user_query),
-    ]
-
-    # Step 5 — Call your agent
-    response = llm_model.invoke(messages)
+    # Step 5 — Call your agent (the system prompt's KV cache is reused across turns)
+    response = run_chat(llm_model, supervisor_system_prompt_3, user_query)
 
-    ai_msg = clean_think_blocks(response.content)
+    ai_msg = clean_think_blocks(response)
 
     print(ai_msg)
 
@@ -88,32 +119,27 @@ def orchestrator(state: GraphState):
         "orchestrator_msg": ai_msg
     }
 
+_ROUTES = {
+    "video_analysis": "video_analyst",
+    "video_analyst": "video_analyst",
+    "transcript_analysis": "transcript_analyst",
+    "transcript_analyst": "transcript_analyst",
+    "report_generation": "report_analyst",
+    "report_analyst": "report_analyst",
+}
+_ROUTE_RE = re.compile(r'"(?:Task_name|agent_name)"\s*:\s*"(' + "|".join(_ROUTES) + r')"')
+
 def orchestrator_route(state: GraphState) -> Literal["video_analyst", "transcript_analyst", "report_analyst", "end"]:
     
     # Often, we will use state to decide on the next node to visit
-    orchestrator_msg = state['orchestrator_msg'] 
+    orchestrator_msg = state['orchestrator_msg']
 
-    try:
-        json_data = json.loads(orchestrator_msg)
-        if json_data:
-            task_name = json_data["Task_name"]
-            agent_name = json_data["agent_name"]
-
-            if task_name == "video_analysis" or agent_name =="video_analyst":
-                return "video_analyst"
-            
-            elif task_name == "transcript_analysis" or agent_name =="transcript_analyst":
-                return "transcript_analyst"
-        
-            elif task_name == "report_generation" or agent_name =="report_analyst":
-                return "report_analyst"
-            else:
-                return "end"
-            
-        else:
-            return "end"
-    except:
-        return "end"
+    # The supervisor prompt only allows a handful of fixed JSON shapes, so a regex scan
+    # is enough to pick the route without a full JSON parse
+    match = _ROUTE_RE.search(orchestrator_msg)
+    if match:
+        return _ROUTES[match.group(1)]
+    return "end"
 
 
 # %%
@@ -123,28 +149,10 @@ def transcript_agent(state: GraphState):
     video_path = state["video_path"]
     transcript_model = state["transcript_model"]
 
-    ai_responses = [
-        "✅ Got it! Here's what I came up with: 👇\n{text}",
-        "💡 Sure thing! Take a look at this: 👇\n{text}",
-        "👍 No worries — here’s my response: 👇\n{text}",
-        "✨ Here’s what I’ve prepared for you: 👇\n{text}",
-        "🤖 Absolutely! Here’s the result: 👇\n{text}",
-        "👌 Sure! This is what I found: 👇\n{text}",
-        "🚀 Done! Here’s my output: 👇\n{text}",
-        "🧠 Here’s my take on that: 👇\n{text}",
-        "📘 Here’s the information you asked for: 👇\n{text}",
-        "✅ All set! Check out my answer below: 👇\n{text}",
-    ]
-
-    # Example usage:
-    # text = "A large language model is an AI trained on massive amounts of text data."
-    # ai_response = random.choice(ai_responses).format(text=text)
-
-
     try:
         text = transcript_model.transcribe(video_path) 
         print("Transcription:", text)
-        ai_response = random.choice(ai_responses).format(text=text)
+        ai_response = next(_ai_response_cycle).format(text=text)
     except Exception as e:
         print(f"Error message: {e}")
         ai_response = "🤒 Sorry, I cannot fullfill your request, a thousand apologies. 👏👏👏"
@@ -161,33 +169,22 @@ def video_agent(state: GraphState):
     smolvlm2 = state["vlm"]
     user_query = state["user_query"]
 
-    # ai_responses = [
-    #     "✅ Got it! Here's what I came up with: 👇\n{text}",
-    #     "💡 Sure thing! Take a look at this: 👇\n{text}",
-    #     "👍 No worries — here’s my response: 👇\n{text}",
-    #     "✨ Here’s what I’ve prepared for you: 👇\n{text}",
-    #     "🤖 Absolutely! Here’s the result: 👇\n{text}",
-    #     "👌 Sure! This is what I found: 👇\n{text}",
-    #     "🚀 Done! Here’s my output: 👇\n{text}",
-    #     "🧠 Here’s my take on that: 👇\n{text}",
-    #     "📘 Here’s the information you asked for: 👇\n{text}",
-    #     "✅ All set! Check out my answer below: 👇\n{text}",
-    # ]
-
-    # Example usage:
-    # text = "A large language model is an AI trained on massive amounts of text data."
-    # ai_response = random.choice(ai_responses).format(text=text)
+    # Forward reply pieces to `stream_mode="custom"` consumers as they are decoded (a no-op
+    # under plain `invoke`); the joined text still becomes final_response for update_memory
+    writer = get_stream_writer()
 
-    
     try:
-        response = smolvlm2.invoke({
+        pieces = []
+        for piece in smolvlm2.stream({
             "role": "user",
             "content": [
                 {"type": "video", "path": video_path},
                 {"type": "text", "text": user_query}
             ]}
-        )
-        ai_msg = extract_assistant_response(response["content"])
+        ):
+            pieces.append(piece)
+            writer(piece)
+        ai_msg = extract_assistant_response("".join(pieces))
         print(f"{ai_msg}")
         ai_response = ai_msg
 
@@ -200,38 +197,20 @@ def video_agent(state: GraphState):
     }
 
 
+def _trim_history(chat_history: str, tokenizer, max_tokens: int = CHAT_HISTORY_MAX_TOKENS) -> str:
+    """Keep only the most recent `max_tokens` tokens of the chat history."""
+    token_ids = tokenizer(chat_history, add_special_tokens=False)["input_ids"]
+    if len(token_ids) <= max_tokens:
+        return chat_history
+    return tokenizer.decode(token_ids[-max_tokens:])
+
+
 def report_agent(state: GraphState):
     print("--------------- Entering: report agent ---------------")
 
-    memory = state["memory"]
-    user_id = state["user_id"]
-    session_id = state["session_id"]
     user_query = state["user_query"]
     llm_model = state["hug_llm"]
-
-    success_responses = [
-        "✨ Sure! Your request has been completed successfully ✅",
-        "✅ Done! Everything went smoothly ✨",
-        "🎯 Request processed successfully — all set!",
-        "👍 Got it! Your request was handled perfectly ✅",
-        "🚀 Success! The task is now complete ✨",
-        "🌟 All done — your request went through successfully ✅",
-        "💪 Mission accomplished! Everything’s done as requested ✨",
-        "🧩 Your request was processed with no issues ✅",
-        "🎉 Great! Everything has been completed successfully ✨",
-        "✅ All set! Your request finished without any errors 🌟",
-    ]
-
-    # Example usage:
-    # ai_response = random.choice(success_responses)
-    # print(ai_response)
-
-    # Load the chat history
-    chat_history = memory.get_context(
-        user_id=user_id,
-        session_id=session_id,
-        top_k=8    
-    )
+    chat_history = _trim_history(state["chat_history"], llm_model.tokenizer)
 
     user_query_with_history = f"""
     Based on our chat history:
@@ -239,22 +218,16 @@ def report_agent(state: GraphState):
     {user_query}
     """
 
-    messages = [
-        SystemMessage(content=report_system_prompt_1),
-        HumanMessage(content=user_query_with_history),
-    ]
-
-    # Step 5 — Call your agent
-    response = llm_model.invoke(messages)
-    ai_msg = response.content
+    # Step 5 — Call your agent (the system prompt's KV cache is reused across turns)
+    ai_msg = run_chat(llm_model, report_system_prompt_1, user_query_with_history)
     ai_msg = clean_think_blocks(text=ai_msg)
     print(ai_msg)
 
     try:
-        function_call = json.loads(ai_msg)
+        function_call = orjson.loads(ai_msg)
 
         report_file_path = generate_report(function_call["args"])
-        ai_response = random.choice(success_responses)
+        ai_response = next(_success_response_cycle)
     except Exception as e:
         print(f"Error message: {e}")
         ai_response = "🤒 Sorry, I cannot fullfill your request, a thousand apologies. 👏👏👏"
@@ -277,18 +250,23 @@ def update_memory(state: GraphState):
     user_query = state["user_query"]
     final_response = state["final_response"]
 
-    memory.add_message(user_id, session_id, "Human", user_query)
-    memory.add_message(user_id, session_id, "AI", final_response)
-
-    # Load the chat history
-    chat_history = memory.get_context(
-        user_id=user_id,
-        session_id=session_id,
-        top_k=8    
+    # Write both turns in one transaction
+    memory.add_messages(
+        user_id,
+        session_id,
+        [("Human", user_query), ("AI", final_response)],
     )
-    print(f"-----Chat History-----")
-    print(f"{chat_history}")
-    print(f"----------------------")
+
+    # Only re-read the updated history for the debug print (skipped under `python -O`)
+    if __debug__:
+        chat_history = memory.get_context(
+            user_id=user_id,
+            session_id=session_id,
+            top_k=CHAT_HISTORY_TOP_K
+        )
+        print(f"-----Chat History-----")
+        print(f"{chat_history}")
+        print(f"----------------------")
 
 
 def build_graph() -> StateGraph:
@@ -325,6 +303,20 @@ def build_graph() -> StateGraph:
 
     return workflow
 
+
+_workflow_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _compiled_workflow():
+    return build_graph()
+
+
+def get_workflow():
+    """Return the process-wide compiled workflow, building it on first use."""
+    with _workflow_lock:
+        return _compiled_workflow()
+
 def demo_usage():
     pass
     # ai_workflow = build_graph()
@@ -1,98 +1,259 @@
+import atexit
 import os
 import pickle
-from typing import Dict, List
+import sqlite3
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from itertools import islice
+from typing import Deque, Dict, List, Tuple
 
+# Number of most recent messages per session mirrored in memory for get_context
+MAX_CONTEXT_MESSAGES = 16
 
-class MemoryManager:
-    def __init__(self, persist: bool = True, filename: str = "memory_store.pkl"):
-        # Structure: { user_id: { session_id: [ {role, content}, ... ] } }
-        self.memory_store: Dict[str, Dict[str, List[Dict[str, str]]]] = {}
+# Persistent managers still alive, checkpointed by a single exit hook. Weak references
+# let a discarded manager (and its connection) be freed instead of pinned by atexit.
+_live_managers: "weakref.WeakSet[MemoryManager]" = weakref.WeakSet()
+
+
+@atexit.register
+def _save_all_memory():
+    for manager in list(_live_managers):
+        manager.save_memory()
 
+
+class MemoryManager:
+    def __init__(self, persist: bool = True, filename: str = "memory_store.db"):
+        # Schema: users -> sessions -> messages (ordered by idx within a session)
         # Persistence settings
         self.persist = persist
         self.filename = os.path.join(os.path.dirname(__file__), filename)
 
-        # Load persisted memory if available
+        # Streamlit reruns the script on worker threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            self.filename if self.persist else ":memory:",
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+
+        # Sliding window of formatted "role: content" lines per (user_id, session_id), plus
+        # the joined context strings built from it, keyed by top_k. Both are dropped on writes.
+        self._recent: Dict[Tuple[str, str], Deque[str]] = {}
+        self._context_cache: Dict[Tuple[str, str], Dict[int, str]] = {}
+
+        # Import the legacy pickle store if this is a fresh database
         if self.persist:
             self.load_memory()
+            _live_managers.add(self)
 
     # ---- Persistence ----
 
+    def _create_tables(self):
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id TEXT,
+                session_id TEXT,
+                PRIMARY KEY (user_id, session_id)
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                user_id TEXT,
+                session_id TEXT,
+                idx INTEGER,
+                role TEXT,
+                content TEXT,
+                PRIMARY KEY (user_id, session_id, idx)
+            );
+            """
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """Run the enclosed statements in one transaction; the caller must hold `self._lock`."""
+        self.conn.execute("BEGIN")
+        try:
+            yield
+            self.conn.execute("COMMIT")
+        except BaseException:
+            # Never leave the shared connection mid-transaction, or every later write fails
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            raise
+
     def save_memory(self):
-        """Save memory to a pickle file."""
+        """Flush the WAL into the main database file."""
         try:
-            with open(self.filename, "wb") as f:
-                pickle.dump(self.memory_store, f)
-        except Exception as e:
+            with self._lock:
+                self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.Error as e:
             print(f"[MemoryManager] Warning: Failed to save memory -> {e}")
 
-    def load_memory(self):
-        """Load memory from a pickle file if it exists."""
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, "rb") as f:
-                    self.memory_store = pickle.load(f)
-            except Exception as e:
-                print(f"[MemoryManager] Warning: Failed to load memory -> {e}")
-                self.memory_store = {}
+    def load_memory(self, legacy_filename: str = "memory_store.pkl"):
+        """Import chat history from the legacy pickle file into an empty database."""
+        legacy_path = os.path.join(os.path.dirname(__file__), legacy_filename)
+        # user_version marks the import as done, so clearing history never resurrects it
+        (imported,) = self.conn.execute("PRAGMA user_version").fetchone()
+        if imported or not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "rb") as f:
+                legacy_store: Dict[str, Dict[str, List[Dict[str, str]]]] = pickle.load(f)
+        except Exception as e:
+            print(f"[MemoryManager] Warning: Failed to load memory -> {e}")
+            return
+
+        with self._lock:
+            with self._transaction():
+                for user_id, sessions in legacy_store.items():
+                    self.conn.execute("INSERT OR IGNORE INTO users VALUES (?)", (user_id,))
+                    for session_id, history in sessions.items():
+                        self.conn.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?)", (user_id, session_id))
+                        self.conn.executemany(
+                            "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?)",
+                            [(user_id, session_id, i, m["role"], m["content"]) for i, m in enumerate(history)],
+                        )
+                self.conn.execute("PRAGMA user_version = 1")
 
     # ---- User & Session Management ----
 
     def add_chat_user(self, user_id: str):
-        if user_id not in self.memory_store:
-            self.memory_store[user_id] = {}
-            if self.persist:
-                self.save_memory()
+        with self._lock:
+            self.conn.execute("INSERT OR IGNORE INTO users VALUES (?)", (user_id,))
 
     def add_chat_session(self, user_id: str, session_id: str):
-        self.add_chat_user(user_id)
-        if session_id not in self.memory_store[user_id]:
-            self.memory_store[user_id][session_id] = []
-            if self.persist:
-                self.save_memory()
+        with self._lock:
+            self.conn.execute("INSERT OR IGNORE INTO users VALUES (?)", (user_id,))
+            self.conn.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?)", (user_id, session_id))
 
     # ---- Message Handling ----
 
     def add_message(self, user_id: str, session_id: str, role: str, content: str):
-        self.add_chat_session(user_id, session_id)
-        self.memory_store[user_id][session_id].append({"role": role, "content": content})
-        if self.persist:
-            self.save_memory()
+        self.add_messages(user_id, session_id, [(role, content)])
+
+    def add_messages(self, user_id: str, session_id: str, messages: List[Tuple[str, str]]):
+        """Append several (role, content) messages in a single transaction."""
+        with self._lock:
+            with self._transaction():
+                self.conn.execute("INSERT OR IGNORE INTO users VALUES (?)", (user_id,))
+                self.conn.execute("INSERT OR IGNORE INTO sessions VALUES (?, ?)", (user_id, session_id))
+                self.conn.executemany(
+                    """
+                    INSERT INTO messages
+                    SELECT ?, ?, COALESCE(MAX(idx), -1) + 1, ?, ?
+                    FROM messages WHERE user_id = ? AND session_id = ?
+                    """,
+                    [(user_id, session_id, role, content, user_id, session_id) for role, content in messages],
+                )
+
+            key = (user_id, session_id)
+            if key in self._recent:
+                self._recent[key].extend(f"{role}: {content}" for role, content in messages)
+            self._context_cache.pop(key, None)
 
     def get_history(self, user_id: str, session_id: str) -> List[Dict[str, str]]:
-        return self.memory_store.get(user_id, {}).get(session_id, [])
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT role, content FROM messages WHERE user_id = ? AND session_id = ? ORDER BY idx",
+                (user_id, session_id),
+            ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
 
     def get_context(self, user_id: str, session_id: str, top_k: int | None = None) -> str:
-        history = self.get_history(user_id, session_id)
-        if not history:
+        if top_k is not None and top_k <= MAX_CONTEXT_MESSAGES:
+            return self._get_recent_context(user_id, session_id, top_k)
+
+        # LIMIT -1 means "no limit" in SQLite
+        with self._lock:
+            rows = self.conn.execute(
+                """
+                SELECT role, content FROM messages WHERE user_id = ? AND session_id = ?
+                ORDER BY idx DESC LIMIT ?
+                """,
+                (user_id, session_id, -1 if top_k is None else top_k),
+            ).fetchall()
+        if not rows:
             return ""
-        if top_k is not None:
-            history = history[-top_k:]
-        return "\n".join([f"{m['role']}: {m['content']}" for m in history])
+        return "\n".join([f"{role}: {content}" for role, content in reversed(rows)])
+
+    def _get_recent_context(self, user_id: str, session_id: str, top_k: int) -> str:
+        """Serve get_context from the in-memory window, loading it from disk on first use."""
+        key = (user_id, session_id)
+        with self._lock:
+            cached = self._context_cache.get(key, {}).get(top_k)
+            if cached is not None:
+                return cached
+
+            recent = self._recent.get(key)
+            if recent is None:
+                rows = self.conn.execute(
+                    """
+                    SELECT role, content FROM messages WHERE user_id = ? AND session_id = ?
+                    ORDER BY idx DESC LIMIT ?
+                    """,
+                    (user_id, session_id, MAX_CONTEXT_MESSAGES),
+                ).fetchall()
+                recent = deque(
+                    (f"{role}: {content}" for role, content in reversed(rows)),
+                    maxlen=MAX_CONTEXT_MESSAGES,
+                )
+                self._recent[key] = recent
+
+            context = "\n".join(islice(recent, max(len(recent) - top_k, 0), None))
+            self._context_cache.setdefault(key, {})[top_k] = context
+            return context
+
+    def _invalidate(self, user_id: str, session_id: str | None = None):
+        """Drop cached context for one session, or for every session of a user."""
+        for cache in (self._recent, self._context_cache):
+            for key in [k for k in cache if k[0] == user_id and session_id in (None, k[1])]:
+                del cache[key]
 
     # ---- Cleanup ----
 
     def clear_session(self, user_id: str, session_id: str):
-        if user_id in self.memory_store and session_id in self.memory_store[user_id]:
-            self.memory_store[user_id][session_id] = []
-            if self.persist:
-                self.save_memory()
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM messages WHERE user_id = ? AND session_id = ?", (user_id, session_id)
+            )
+            self._invalidate(user_id, session_id)
 
     def remove_session(self, user_id: str, session_id: str):
-        if user_id in self.memory_store:
-            self.memory_store[user_id].pop(session_id, None)
-            if self.persist:
-                self.save_memory()
+        with self._lock:
+            with self._transaction():
+                self.conn.execute(
+                    "DELETE FROM messages WHERE user_id = ? AND session_id = ?", (user_id, session_id)
+                )
+                self.conn.execute(
+                    "DELETE FROM sessions WHERE user_id = ? AND session_id = ?", (user_id, session_id)
+                )
+            self._invalidate(user_id, session_id)
 
     def remove_user(self, user_id: str):
-        self.memory_store.pop(user_id, None)
-        if self.persist:
-            self.save_memory()
+        with self._lock:
+            with self._transaction():
+                self.conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+                self.conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+                self.conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            self._invalidate(user_id)
 
     # ---- Utility ----
 
     def list_users(self) -> List[str]:
-        return list(self.memory_store.keys())
+        with self._lock:
+            rows = self.conn.execute("SELECT user_id FROM users ORDER BY rowid").fetchall()
+        return [user_id for (user_id,) in rows]
 
     def list_sessions(self, user_id: str) -> List[str]:
-        return list(self.memory_store.get(user_id, {}).keys())
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT session_id FROM sessions WHERE user_id = ? ORDER BY rowid", (user_id,)
+            ).fetchall()
+        return [session_id for (session_id,) in rows]
@@ -1,15 +1,74 @@
+from functools import lru_cache
 from pathlib import Path
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.dml.color import RGBColor
+from types import SimpleNamespace
 from typing import Literal
 from langchain_core.tools import tool
 import re
 
+# reportlab and python-pptx are imported on first use of each format, so importing this
+# module (and the agent graph) does not pay for both libraries up front.
+
+# === Report output folder, next to this script ===
+_REPORT_DIR = Path(__file__).parent / "report"
+_REPORT_DIR.mkdir(exist_ok=True)
+
+
+@lru_cache(maxsize=1)
+def _pdf_assets() -> SimpleNamespace:
+    """Build the PDF paragraph styles once, on the first PDF report."""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    styles = getSampleStyleSheet()
+    return SimpleNamespace(
+        # === PDF paragraph styles ===
+        title_style=ParagraphStyle(
+            "TitleCustom",
+            parent=styles["Title"],
+            fontSize=22,
+            leading=28,
+            textColor=colors.HexColor("#2C3E50"),
+            spaceAfter=20,
+        ),
+        heading_style=ParagraphStyle(
+            "HeadingCustom",
+            parent=styles["Heading2"],
+            fontSize=14,
+            textColor=colors.HexColor("#1ABC9C"),
+            spaceBefore=15,
+            spaceAfter=8,
+        ),
+        body_style=ParagraphStyle(
+            "BodyCustom",
+            parent=styles["BodyText"],
+            fontSize=11,
+            leading=16,
+            textColor=colors.HexColor("#2F3640"),
+        ),
+        rule_color=colors.HexColor("#BDC3C7"),
+    )
+
+
+@lru_cache(maxsize=1)
+def _pptx_assets() -> SimpleNamespace:
+    """Build the PPTX textbox geometry and colors once, on the first PPTX report."""
+    from pptx.util import Inches
+    from pptx.dml.color import RGBColor
+
+    return SimpleNamespace(
+        # === PPTX textbox geometry ===
+        heading_box=(Inches(0.8), Inches(0.8), Inches(8.4), Inches(1)),
+        content_box=(Inches(0.8), Inches(2), Inches(8.4), Inches(4.5)),
+        # === PPTX colors ===
+        c_title=RGBColor(44, 62, 80),
+        c_heading=RGBColor(26, 188, 156),
+        c_body=RGBColor(52, 73, 94),
+    )
+
+# === Response cleanup patterns ===
+_THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+_PREFIX_RE = re.compile(r"^🧠\s*Response:\s*")
+
 @tool
 def generate_report(
     file_type: Literal["pdf", "pptx"],
@@ -23,16 +82,19 @@ def generate_report(
     as this script.
     """
 
-    # === Ensure the 'report' folder exists ===
-    base_dir = Path(__file__).parent
-    report_dir = base_dir / "report"
-    report_dir.mkdir(exist_ok=True)
-
     # Full output file path (inside 'report' folder)
-    file_path = report_dir / f"{output_path}.{file_type}"
+    file_path = _REPORT_DIR / f"{output_path}.{file_type}"
 
     # === PDF GENERATION ===
     if file_type == "pdf":
+        from reportlab.lib.pagesizes import A4
+        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, HRFlowable
+
+        pdf_assets = _pdf_assets()
+        # Flowables are reused across sections of this story only: reportlab sets per-build
+        # state on them (canv, _frame, _width), so they are not shared between concurrent builds
+        hr = HRFlowable(width="100%", color=pdf_assets.rule_color, thickness=0.8)
+        spacer_8, spacer_12, spacer_20 = Spacer(1, 8), Spacer(1, 12), Spacer(1, 20)
         doc = SimpleDocTemplate(
             str(file_path),
             pagesize=A4,
@@ -42,47 +104,23 @@ def generate_report(
             rightMargin=60,
         )
 
-        styles = getSampleStyleSheet()
-
-        title_style = ParagraphStyle(
-            "TitleCustom",
-            parent=styles["Title"],
-            fontSize=22,
-            leading=28,
-            textColor=colors.HexColor("#2C3E50"),
-            spaceAfter=20,
-        )
-
-        heading_style = ParagraphStyle(
-            "HeadingCustom",
-            parent=styles["Heading2"],
-            fontSize=14,
-            textColor=colors.HexColor("#1ABC9C"),
-            spaceBefore=15,
-            spaceAfter=8,
-        )
-
-        body_style = ParagraphStyle(
-            "BodyCustom",
-            parent=styles["BodyText"],
-            fontSize=11,
-            leading=16,
-            textColor=colors.HexColor("#2F3640"),
-        )
-
-        story = [Paragraph(title, title_style), Spacer(1, 20)]
+        story = [Paragraph(title, pdf_assets.title_style), spacer_20]
 
         for section in sections:
-            story.append(HRFlowable(width="100%", color=colors.HexColor("#BDC3C7"), thickness=0.8))
-            story.append(Spacer(1, 8))
-            story.append(Paragraph(section["heading"], heading_style))
-            story.append(Paragraph(section["content"], body_style))
-            story.append(Spacer(1, 12))
+            story.append(hr)
+            story.append(spacer_8)
+            story.append(Paragraph(section["heading"], pdf_assets.heading_style))
+            story.append(Paragraph(section["content"], pdf_assets.body_style))
+            story.append(spacer_12)
 
         doc.build(story)
 
     # === POWERPOINT GENERATION ===
     elif file_type == "pptx":
+        from pptx import Presentation
+        from pptx.util import Pt
+
+        pptx_assets = _pptx_assets()
         prs = Presentation()
         title_slide_layout = prs.slide_layouts[0]
 
@@ -91,30 +129,28 @@ def generate_report(
         slide.placeholders[1].text = "Generated automatically"
         slide.shapes.title.text_frame.paragraphs[0].font.size = Pt(36)
         slide.shapes.title.text_frame.paragraphs[0].font.bold = True
-        slide.shapes.title.text_frame.paragraphs[0].font.color.rgb = RGBColor(44, 62, 80)
+        slide.shapes.title.text_frame.paragraphs[0].font.color.rgb = pptx_assets.c_title
 
         for section in sections:
             slide_layout = prs.slide_layouts[5]
             slide = prs.slides.add_slide(slide_layout)
 
             # Heading box
-            left, top, width, height = Inches(0.8), Inches(0.8), Inches(8.4), Inches(1)
-            title_box = slide.shapes.add_textbox(left, top, width, height)
+            title_box = slide.shapes.add_textbox(*pptx_assets.heading_box)
             title_frame = title_box.text_frame
             p = title_frame.add_paragraph()
             p.text = section["heading"]
             p.font.bold = True
             p.font.size = Pt(28)
-            p.font.color.rgb = RGBColor(26, 188, 156)
+            p.font.color.rgb = pptx_assets.c_heading
 
             # Content box
-            left, top, width, height = Inches(0.8), Inches(2), Inches(8.4), Inches(4.5)
-            content_box = slide.shapes.add_textbox(left, top, width, height)
+            content_box = slide.shapes.add_textbox(*pptx_assets.content_box)
             tf = content_box.text_frame
             p = tf.add_paragraph()
             p.text = section["content"]
             p.font.size = Pt(18)
-            p.font.color.rgb = RGBColor(52, 73, 94)
+            p.font.color.rgb = pptx_assets.c_body
             p.line_spacing = 1.3
 
         prs.save(str(file_path))
@@ -128,7 +164,7 @@ def clean_think_blocks(text: str) -> str:
     """
     Removes all <think>...</think> sections from the given text.
     """
-    cleaned_text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+    cleaned_text = _THINK_RE.sub("", text)
     return cleaned_text.strip()
 
 def extract_assistant_response(text: str) -> str:
@@ -142,11 +178,11 @@ def extract_assistant_response(text: str) -> str:
             "Yes, there is a graph in the video. It shows the progress..."
     """
     # Remove leading emojis or response prefixes like "🧠 Response:"
-    cleaned_text = re.sub(r"^🧠\s*Response:\s*", "", text.strip())
+    cleaned_text = _PREFIX_RE.sub("", text.strip())
 
-    # Use regex to find text after 'Assistant:'
-    match = re.search(r"Assistant:\s*(.*)", cleaned_text, re.DOTALL)
-    if match:
-        # Clean trailing whitespace/newlines
-        return match.group(1).strip()
+    # Keep the text after the first 'Assistant:'
+    _, sep, response = cleaned_text.partition("Assistant:")
+    if sep:
+        # Clean surrounding whitespace/newlines
+        return response.strip()
     return cleaned_text.strip()
\ No newline at end of file
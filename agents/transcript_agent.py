@@ -1,11 +1,71 @@
 from __future__ import annotations
-from typing import Optional
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterator, Literal, Optional
+import subprocess
+import tempfile
+import numpy as np
 import torch
+import torch.nn.functional as F
 import torchaudio
+import imageio_ffmpeg
 from transformers import WhisperProcessor, WhisperForConditionalGeneration
-from moviepy import VideoFileClip
 from pathlib import Path
-import os
+
+# Whisper models are trained on 16 kHz mono audio
+SAMPLING_RATE = 16000
+
+
+def _prefetch(items: Iterator[torch.Tensor], maxsize: int = 2) -> Iterator[torch.Tensor]:
+    """
+    Run `items` on a background thread, buffering up to `maxsize` results ahead of the consumer.
+
+    Errors raised by the producer are re-raised in the consumer. If the consumer stops early,
+    the producer is signalled to stop and the underlying iterator is closed.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(done)
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(produce)
+        try:
+            while True:
+                try:
+                    item = buffer.get(timeout=0.1)
+                except queue.Empty:
+                    if future.done():
+                        future.result()  # re-raise producer errors
+                        return
+                    continue
+                if item is done:
+                    return
+                yield item
+        finally:
+            stop.set()
 
 
 class VoiceToText:
@@ -13,23 +73,28 @@ class VoiceToText:
     A utility class for automatic speech recognition (ASR) using Whisper models.
 
     This class can:
-      • Extract audio from video files (e.g., MP4 → WAV)
-      • Transcribe audio to text using Hugging Face Whisper models
-      • Automatically clean up temporary files
+      • Decode audio from video files (e.g., MP4) straight into memory via FFmpeg
+      • Transcribe audio to text using Hugging Face Whisper models, or optionally the
+        CTranslate2-based `faster-whisper` backend (`pip install faster-whisper`)
 
     Attributes:
+        backend (str): The inference backend ("transformers" or "faster-whisper").
         processor (WhisperProcessor): The Hugging Face processor for Whisper.
-        model (WhisperForConditionalGeneration): The loaded Whisper model instance.
+        model (WhisperForConditionalGeneration | faster_whisper.WhisperModel): The loaded Whisper model instance.
         device (str): The target device for inference ("cuda" or "cpu").
+        dtype (torch.dtype): Weight/feature dtype (float16 on GPU, float32 on CPU).
         model_dir (Path): Local cache directory for model files.
     """
 
     # openai/whisper-tiny openai/whisper-tiny.en
     def __init__(
         self,
-        model_name: str = "openai/whisper-tiny",
+        model_name: str = "openai/whisper-tiny.en",
         device: Optional[str] = None,
         model_root: Optional[str | Path] = None,
+        compile_model: bool = False,
+        language: Optional[str] = "en",
+        backend: Literal["transformers", "faster-whisper"] = "transformers",
     ) -> None:
         """
         Initialize the Whisper voice-to-text transcriber.
@@ -38,8 +103,18 @@ class VoiceToText:
             model_name: The Hugging Face model ID to load (e.g., "openai/whisper-tiny.en").
             device: Target device for computation. Defaults to "cuda" if available.
             model_root: Optional local directory for caching model weights.
+            compile_model: Wrap the model forward in `torch.compile` to fuse decoder kernels.
+                Defaults to False since the first call pays a long compilation cost.
+            language: Spoken language passed to multilingual checkpoints, which skips the
+                language-detection pass. Use None to auto-detect. Ignored by ".en" models.
+            backend: "transformers" (default) or "faster-whisper", which runs the same checkpoint
+                through CTranslate2 with int8 weights and handles long-form audio internally.
         """
+        self.backend: str = backend
+        self.language: Optional[str] = None if model_name.endswith(".en") else language
         self.device: str = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        # Half precision only pays off on GPU; CPU matmuls in fp16 are slower than fp32
+        self.dtype: torch.dtype = torch.float16 if self.device.startswith("cuda") else torch.float32
 
         # === Define local cache directory ===
         model_root = Path(model_root) if model_root else Path(__file__).parent.parent / "model"
@@ -49,6 +124,10 @@ class VoiceToText:
         print(f"🔹 Loading Whisper model: {model_name}")
         print(f"📂 Model cache directory: {self.model_dir}")
 
+        if backend == "faster-whisper":
+            self._load_faster_whisper(model_name)
+            return
+
         # === Load model and processor ===
         self.processor: WhisperProcessor = WhisperProcessor.from_pretrained(
             model_name,
@@ -57,61 +136,202 @@ class VoiceToText:
         self.model: WhisperForConditionalGeneration = WhisperForConditionalGeneration.from_pretrained(
             model_name,
             cache_dir=self.model_dir,
+            torch_dtype=self.dtype,
+            attn_implementation="sdpa",
         ).to(self.device)
+        self.model.eval()
+
+        # === Greedy decoding defaults ===
+        generation_config = self.model.generation_config
+        generation_config.num_beams = 1
+        generation_config.do_sample = False
+        generation_config.use_cache = True
+        generation_config.max_new_tokens = 444  # 448 decoder positions minus the 4 prompt tokens
+        if getattr(generation_config, "is_multilingual", False) and self.language is not None:
+            generation_config.language = self.language
+            generation_config.task = "transcribe"
+
+        # === Log-mel front end on the inference device ===
+        # Reuse the processor's exact STFT settings and mel filter bank so features match
+        # WhisperFeatureExtractor, but compute them on-device instead of in NumPy.
+        feature_extractor = self.processor.feature_extractor
+        self.n_fft: int = feature_extractor.n_fft
+        self.hop_length: int = feature_extractor.hop_length
+        self.n_samples: int = feature_extractor.n_samples
+        self._window: torch.Tensor = torch.hann_window(self.n_fft, device=self.device)
+        self._mel_filters: torch.Tensor = torch.from_numpy(feature_extractor.mel_filters).to(
+            self.device, dtype=torch.float32
+        )
+        # Resample kernels keyed by source rate, built on-device on first use
+        self._resamplers: dict[int, torchaudio.transforms.Resample] = {}
 
-        print(f"✅ Whisper model loaded successfully on {self.device}")
+        if compile_model:
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead")
+
+        print(f"✅ Whisper model loaded successfully on {self.device} ({self.dtype})")
+
+    # -------------------------------------------------------------------------
+    def _load_faster_whisper(self, model_name: str) -> None:
+        """
+        Load the checkpoint with the optional `faster-whisper` (CTranslate2) backend.
+
+        Args:
+            model_name: The Hugging Face model ID (e.g., "openai/whisper-tiny.en").
+
+        Raises:
+            ImportError: If `faster-whisper` is not installed.
+        """
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError as e:
+            raise ImportError(
+                "The 'faster-whisper' backend requires `pip install faster-whisper`."
+            ) from e
+
+        # faster-whisper names checkpoints by size, e.g. "openai/whisper-tiny.en" -> "tiny.en"
+        size = model_name.split("/")[-1].removeprefix("whisper-")
+        compute_type = "int8_float16" if self.device.startswith("cuda") else "int8"
+
+        self.model = WhisperModel(
+            size,
+            device="cuda" if self.device.startswith("cuda") else "cpu",
+            compute_type=compute_type,
+            download_root=str(self.model_dir),
+        )
+
+        print(f"✅ faster-whisper model loaded successfully on {self.device} ({compute_type})")
 
     # -------------------------------------------------------------------------
-    def extract_audio_from_video(self, video_path: str | Path) -> str:
+    def iter_video_chunks(self, video_path: str | Path, chunk_size: int) -> Iterator[torch.Tensor]:
         """
-        Extract the audio track from a video file and save it as a WAV file.
+        Stream the audio track of a video file as 16 kHz mono chunks.
 
-        The output audio file is saved in the same directory as the video.
+        FFmpeg downmixes and resamples while decoding and writes raw PCM to a pipe, which is
+        read `chunk_size` samples at a time, so chunks become available while FFmpeg is still
+        decoding the rest of the file.
 
         Args:
             video_path: Path to the input video file (e.g., ".mp4").
+            chunk_size: Number of samples per chunk. The last chunk may be shorter.
 
-        Returns:
-            The path to the extracted WAV file as a string.
+        Yields:
+            1-D float32 CPU tensors of samples in [-1, 1] at 16 kHz.
 
         Raises:
             ValueError: If the video contains no audio stream.
+            RuntimeError: If FFmpeg fails to open or fully decode the file (e.g. a missing or
+                truncated video), with FFmpeg's error message.
         """
         video_path = Path(video_path)
-        output_wav_path = video_path.with_suffix(".wav")
 
-        clip = VideoFileClip(str(video_path))
+        command = [
+            imageio_ffmpeg.get_ffmpeg_exe(),
+            "-nostdin",
+            "-loglevel", "error",
+            "-i", str(video_path),
+            "-vn",
+            "-ac", "1",
+            "-ar", str(SAMPLING_RATE),
+            "-f", "s16le",
+            "-acodec", "pcm_s16le",
+            "pipe:1",
+        ]
+        # stderr goes to a temp file rather than a pipe, so a chatty decoder can never block
+        # on a full stderr pipe while stdout is being read
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+
+            num_samples = 0
+            try:
+                while buf := process.stdout.read(chunk_size * 2):  # 2 bytes per s16le sample
+                    pcm = np.frombuffer(buf, dtype=np.int16).astype(np.float32) / 32768.0
+                    num_samples += pcm.shape[0]
+                    yield torch.from_numpy(pcm)
+            finally:
+                # Also reached when the consumer stops early; the exit code is not checked then
+                process.stdout.close()
+                if process.poll() is None:
+                    process.kill()
+                process.wait()
+
+            stderr.seek(0)
+            error = stderr.read().decode(errors="replace").strip()
+
+        # FFmpeg refuses to write an audio-only output when the video has no audio stream
+        if num_samples == 0 and (process.returncode == 0 or "does not contain any stream" in error):
+            raise ValueError(f"No audio stream found in video: {video_path.name}")
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"FFmpeg failed to decode audio from {video_path.name} "
+                f"(exit code {process.returncode}): {error or 'no error output'}"
+            )
+        print(f"🎵 Decoded {num_samples / SAMPLING_RATE:.1f}s of audio from: {video_path.name}")
 
-        try:
-            # Handle videos with no audio
-            if clip.audio is None:
-                raise ValueError(f"No audio stream found in video: {video_path.name}")
+    # -------------------------------------------------------------------------
+    def extract_audio_from_video(self, video_path: str | Path) -> torch.Tensor:
+        """
+        Decode the whole audio track of a video file into a 16 kHz mono waveform.
 
-            clip.audio.write_audiofile(str(output_wav_path), codec="pcm_s16le")
-            print(f"🎵 Extracted audio to: {output_wav_path}")
+        Args:
+            video_path: Path to the input video file (e.g., ".mp4").
 
-        finally:
-            clip.close()
+        Returns:
+            A 1-D float32 tensor of samples in [-1, 1] at 16 kHz.
+
+        Raises:
+            ValueError: If the video contains no audio stream.
+        """
+        return torch.cat(list(self.iter_video_chunks(video_path, chunk_size=30 * SAMPLING_RATE)))
+
+    # -------------------------------------------------------------------------
+    def _log_mel_spectrogram(self, chunks: torch.Tensor) -> torch.Tensor:
+        """
+        Compute Whisper log-mel input features for a batch of 30-second chunks.
+
+        Args:
+            chunks: A (N, n_samples) float32 tensor of 16 kHz audio on `self.device`.
+
+        Returns:
+            A (N, n_mels, 3000) tensor of input features in `self.dtype`.
+        """
+        stft = torch.stft(
+            chunks,
+            self.n_fft,
+            self.hop_length,
+            window=self._window,
+            return_complex=True,
+        )
+        magnitudes = stft[..., :-1].abs() ** 2
+
+        mel_spec = self._mel_filters.T @ magnitudes
+        log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+
+        # Dynamic range compression relative to each chunk's peak, as in WhisperFeatureExtractor
+        max_val = log_spec.amax(dim=(1, 2), keepdim=True)
+        log_spec = torch.maximum(log_spec, max_val - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
 
-        return str(output_wav_path)
+        return log_spec.to(self.dtype)
 
     # -------------------------------------------------------------------------
     def transcribe(
         self,
         file_path: str | Path,
         chunk_length_s: int = 30,
+        batch_size: int = 8,
     ) -> str:
         """
         Transcribe an audio or video file to text.
 
         Automatically handles:
-          • MP4 → WAV audio extraction
-          • Chunked transcription for long audio
-          • Temporary WAV cleanup
+          • MP4 audio decoding (in memory, no temporary WAV), prefetched on a background
+            thread so FFmpeg decodes the next chunks while the current batch is transcribed
+          • Chunked transcription for long audio, batched into few `generate` calls
 
         Args:
             file_path: Path to the audio or video file.
             chunk_length_s: Length (in seconds) of each chunk for transcription. Defaults to 30s.
+            batch_size: Number of chunks decoded together per `generate` call. Defaults to 8.
 
         Returns:
             The full transcribed text as a string.
@@ -120,50 +340,74 @@ class VoiceToText:
             ValueError: If no audio data is found in the file.
         """
         file_path = Path(file_path)
-        temp_audio_path: Optional[str] = None
 
-        try:
-            # === 1. If video, extract temporary audio file ===
-            if file_path.suffix.lower() == ".mp4":
-                temp_audio_path = self.extract_audio_from_video(file_path)
-                file_path = Path(temp_audio_path)
+        # faster-whisper decodes the file and handles long-form chunking itself
+        if self.backend == "faster-whisper":
+            segments, _ = self.model.transcribe(str(file_path), beam_size=1, language=self.language)
+            return " ".join(map(str.strip, (segment.text for segment in segments)))
+
+        chunk_size = chunk_length_s * SAMPLING_RATE
 
-            # === 2. Load audio ===
+        # === 1. Produce 16 kHz mono chunks ===
+        if file_path.suffix.lower() == ".mp4":
+            chunks = _prefetch(self.iter_video_chunks(file_path, chunk_size))
+        else:
             speech_array, sampling_rate = torchaudio.load(str(file_path))
             if speech_array.numel() == 0:
                 raise ValueError(f"The file '{file_path}' contains no audio data.")
 
-            # === 3. Resample if needed ===
-            if sampling_rate != 16000:
-                resampler = torchaudio.transforms.Resample(sampling_rate, 16000)
-                speech_array = resampler(speech_array)
-                sampling_rate = 16000
+            waveform = speech_array.to(self.device).mean(dim=0)  # downmix to mono
+
+            # Resample on-device if needed
+            if sampling_rate != SAMPLING_RATE:
+                if sampling_rate not in self._resamplers:
+                    self._resamplers[sampling_rate] = torchaudio.transforms.Resample(
+                        sampling_rate, SAMPLING_RATE
+                    ).to(self.device)
+                waveform = self._resamplers[sampling_rate](waveform)
+
+            chunks = iter(waveform.split(chunk_size))
+
+        # === 2. Transcribe chunks in batches as they arrive ===
+        all_text: list[str] = []
+        while batch := list(itertools.islice(chunks, batch_size)):
+            # Zero-pad (or trim) every chunk to Whisper's 30s window
+            batch_audio = torch.stack([
+                F.pad(chunk[:self.n_samples], (0, self.n_samples - min(chunk.shape[0], self.n_samples)))
+                for chunk in batch
+            ]).to(self.device)
+            input_features = self._log_mel_spectrogram(batch_audio)
+
+            with torch.inference_mode():
+                predicted_ids = self.model.generate(input_features)
+            transcriptions = self.processor.batch_decode(
+                predicted_ids, skip_special_tokens=True
+            )
+            all_text.extend(transcriptions)
 
-            # === 4. Process chunks ===
-            chunk_size = chunk_length_s * sampling_rate
-            all_text: list[str] = []
+        return " ".join(map(str.strip, all_text))
 
-            for i in range(0, speech_array.shape[1], chunk_size):
-                chunk = speech_array[:, i:i + chunk_size]
-                if chunk.shape[1] == 0:
-                    continue
 
-                input_features = self.processor(
-                    chunk.squeeze().numpy(),
-                    sampling_rate=sampling_rate,
-                    return_tensors="pt",
-                ).input_features.to(self.device)
+# -------------------------------------------------------------------------
+_model_lock = threading.Lock()
 
-                predicted_ids = self.model.generate(input_features)
-                transcription = self.processor.batch_decode(
-                    predicted_ids, skip_special_tokens=True
-                )[0]
-                all_text.append(transcription.strip())
 
-            return " ".join(all_text)
+@lru_cache(maxsize=1)
+def _load_voice_to_text(
+    model_name: str,
+    device: Optional[str],
+    model_root: Optional[str | Path],
+    backend: Literal["transformers", "faster-whisper"],
+) -> VoiceToText:
+    return VoiceToText(model_name=model_name, device=device, model_root=model_root, backend=backend)
 
-        finally:
-            # === 5. Clean up temporary file ===
-            if temp_audio_path and os.path.exists(temp_audio_path):
-                os.remove(temp_audio_path)
-                print(f"🧹 Removed temporary file: {temp_audio_path}")
+
+def get_voice_to_text(
+    model_name: str = "openai/whisper-tiny.en",
+    device: Optional[str] = None,
+    model_root: Optional[str | Path] = None,
+    backend: Literal["transformers", "faster-whisper"] = "transformers",
+) -> VoiceToText:
+    """Return the process-wide VoiceToText instance, loading the model on first use."""
+    with _model_lock:
+        return _load_voice_to_text(model_name, device, model_root, backend)
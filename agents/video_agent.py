@@ -1,9 +1,26 @@
 from __future__ import annotations
-from typing import Literal, Any
+import gc
+import logging
+import threading
+from functools import lru_cache
+from typing import Iterator, Literal, Any
 import torch
-from transformers import AutoProcessor, AutoModelForImageTextToText, BitsAndBytesConfig
+from transformers import AutoProcessor, AutoModelForImageTextToText, BitsAndBytesConfig, TextIteratorStreamer
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+# Default root folder for model checkpoints, resolved once at import
+_DEFAULT_MODEL_ROOT = Path(__file__).resolve().parent.parent / "model"
+
+
+@lru_cache(maxsize=1)
+def _total_vram_gb() -> float | None:
+    """Return the total memory of CUDA device 0 in GB (None without CUDA), queried once per process."""
+    if not torch.cuda.is_available():
+        return None
+    return torch.cuda.get_device_properties(0).total_memory / 1e9
+
 
 class SmolVLM2ChatModel:
     """
@@ -14,6 +31,10 @@ class SmolVLM2ChatModel:
     GPU VRAM if `model_size` is not specified, and supports 4-bit or 8-bit quantization
     using `bitsandbytes`.
 
+    On CUDA with half-precision weights, FlashAttention-2 is used when the `flash-attn`
+    package is installed (`pip install flash-attn --no-build-isolation`); otherwise the
+    model falls back to PyTorch SDPA attention.
+
     Attributes:
         device (str): Target device for model execution (e.g., "cuda" or "cpu").
         quantization (str): Quantization type ("none", "8bit", or "4bit").
@@ -36,6 +57,7 @@ class SmolVLM2ChatModel:
         dtype: torch.dtype = torch.bfloat16,
         quantization: Literal["none", "8bit", "4bit"] = "none",
         model_root: str | Path | None = None,
+        compile_model: bool = False,
     ) -> None:
         """
         Initialize the SmolVLM2ChatModel.
@@ -47,6 +69,9 @@ class SmolVLM2ChatModel:
             dtype: Torch dtype for model weights. Defaults to `torch.bfloat16`.
             quantization: Quantization mode ("none", "8bit", or "4bit"). Defaults to "none".
             model_root: Optional path to a local root folder for storing model checkpoints.
+            compile_model: Wrap the model forward in `torch.compile` to fuse decode-step kernels.
+                Defaults to False since the first call pays a long compilation cost. Ignored for
+                quantized models, since bitsandbytes kernels do not trace cleanly.
         """
         self.device: str = device or ("cuda" if torch.cuda.is_available() else "cpu")
         self.quantization: str = quantization
@@ -56,13 +81,13 @@ class SmolVLM2ChatModel:
             model_size = self._auto_select_model_size()
 
         self.model_name: str = self.MODEL_MAP.get(model_size, self.MODEL_MAP["medium"])
-        print(f"🔹 Preparing to load {self.model_name} ({model_size}) with {quantization} quantization...")
+        logger.debug("🔹 Preparing to load %s (%s) with %s quantization...", self.model_name, model_size, quantization)
 
         # === 2. Define local cache directory ===
-        model_root = Path(model_root) if model_root else Path(__file__).parent.parent / "model"
+        model_root = Path(model_root) if model_root else _DEFAULT_MODEL_ROOT
         self.model_dir: Path = model_root / self.model_name.split("/")[-1]
         self.model_dir.mkdir(parents=True, exist_ok=True)
-        print(f"📂 Model cache directory: {self.model_dir}")
+        logger.debug("📂 Model cache directory: %s", self.model_dir)
 
         # === 3. Configure quantization ===
         quant_config: BitsAndBytesConfig | None = None
@@ -75,9 +100,9 @@ class SmolVLM2ChatModel:
                     bnb_4bit_use_double_quant=True,
                     bnb_4bit_compute_dtype=torch.float16,
                 )
-                print(f"⚙️ Using bitsandbytes {quantization} quantization.")
+                logger.debug("⚙️ Using bitsandbytes %s quantization.", quantization)
             except Exception as e:
-                print(f"⚠️ Quantization unavailable ({e}), loading without it.")
+                logger.warning("⚠️ Quantization unavailable (%s), loading without it.", e)
                 quant_config = None
 
         # === 4. Load processor ===
@@ -85,22 +110,53 @@ class SmolVLM2ChatModel:
             self.model_name,
             cache_dir=self.model_dir,
         )
+        # Decoder-only generation needs left padding so every row ends at its last prompt token
+        self.processor.tokenizer.padding_side = "left"
 
         # === 5. Load model ===
-        print(f"🚀 Loading model weights into {self.device}...")
-        self.model = AutoModelForImageTextToText.from_pretrained(
-            self.model_name,
+        # Quantized weights are placed straight on the single target GPU; multi-GPU setups
+        # should pass their own device_map (e.g. "auto") here instead.
+        logger.debug("🚀 Loading model weights into %s...", self.device)
+        load_kwargs: dict[str, Any] = dict(
             cache_dir=self.model_dir,
             torch_dtype=dtype,
             quantization_config=quant_config,
-            device_map="auto" if quant_config else None,
+            device_map={"": self.device} if quant_config and self.device.startswith("cuda") else None,
+            low_cpu_mem_usage=True,
         )
+        use_flash_attn = self.device.startswith("cuda") and dtype in (torch.bfloat16, torch.float16)
+        try:
+            self.model = AutoModelForImageTextToText.from_pretrained(
+                self.model_name,
+                attn_implementation="flash_attention_2" if use_flash_attn else "sdpa",
+                **load_kwargs,
+            )
+        except (ImportError, ValueError) as e:
+            if not use_flash_attn:
+                raise
+            logger.warning("⚠️ FlashAttention-2 unavailable (%s), falling back to SDPA.", e)
+            self.model = AutoModelForImageTextToText.from_pretrained(
+                self.model_name,
+                attn_implementation="sdpa",
+                **load_kwargs,
+            )
 
         # === 6. Move to device if not quantized ===
         if not quant_config:
             self.model.to(self.device)
 
-        print(f"✅ Successfully loaded {model_size.upper()} SmolVLM2 model ({self.device})!")
+        # Floating-point inputs are cast once to the dtype of the non-quantized modules (vision
+        # encoder, norms), which is what the model would cast pixel values to internally anyway
+        self._compute_dtype: torch.dtype = self.model.dtype
+
+        # Inference only: disable dropout and set the pad token once instead of per call
+        self.model.eval()
+        self.model.generation_config.pad_token_id = self.processor.tokenizer.pad_token_id
+
+        if compile_model and not quant_config:
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead")
+
+        logger.debug("✅ Successfully loaded %s SmolVLM2 model (%s)!", model_size.upper(), self.device)
 
     # -------------------------------------------------------------------------
     def _auto_select_model_size(self) -> Literal["small", "medium", "large"]:
@@ -110,13 +166,12 @@ class SmolVLM2ChatModel:
         Returns:
             The recommended model size as a string literal.
         """
-        if not torch.cuda.is_available():
-            print("⚠️ CUDA not available. Using CPU-friendly 256M model.")
-            return "small"
-
         try:
-            total_vram_gb: float = torch.cuda.get_device_properties(0).total_memory / 1e9
-            print(f"🧮 Detected VRAM: {total_vram_gb:.1f} GB")
+            total_vram_gb = _total_vram_gb()
+            if total_vram_gb is None:
+                logger.warning("⚠️ CUDA not available. Using CPU-friendly 256M model.")
+                return "small"
+            logger.debug("🧮 Detected VRAM: %.1f GB", total_vram_gb)
 
             if total_vram_gb < 6:
                 return "small"
@@ -125,7 +180,7 @@ class SmolVLM2ChatModel:
             else:
                 return "large"
         except Exception as e:
-            print("⚠️ Could not detect VRAM:", e)
+            logger.warning("⚠️ Could not detect VRAM: %s", e)
             return "medium"
 
     # -------------------------------------------------------------------------
@@ -161,21 +216,123 @@ class SmolVLM2ChatModel:
         Returns:
             The decoded model response as a string.
         """
+        return self._generate_batch([formatted_messages], max_new_tokens, do_sample)[0]
+
+    # -------------------------------------------------------------------------
+    def _prepare_inputs(self, conversations: list[list[dict[str, Any]]]) -> dict[str, torch.Tensor]:
+        """
+        Tokenize conversations into one left-padded batch on the model device.
+
+        Args:
+            conversations: A list of formatted chat message lists, one per conversation.
+
+        Returns:
+            The processor outputs, ready to pass to `model.generate`.
+        """
         inputs = self.processor.apply_chat_template(
-            formatted_messages,
+            conversations,
             add_generation_prompt=True,
             tokenize=True,
+            padding=True,
             return_dict=True,
             return_tensors="pt",
-        ).to(self.device, dtype=torch.bfloat16)
+        )
+        # Only pixel values are cast; token ids and masks keep their integer/bool dtypes
+        return {
+            k: v.to(self.device, dtype=self._compute_dtype) if v.is_floating_point() else v.to(self.device)
+            for k, v in inputs.items()
+        }
+
+    # -------------------------------------------------------------------------
+    def _generate_batch(
+        self,
+        conversations: list[list[dict[str, Any]]],
+        max_new_tokens: int = 512,
+        do_sample: bool = False,
+    ) -> list[str]:
+        """
+        Run text generation on several conversations in a single `generate` call.
+
+        Args:
+            conversations: A list of formatted chat message lists, one per conversation.
+            max_new_tokens: Maximum number of tokens to generate. Defaults to 512.
+            do_sample: Whether to enable sampling (for creativity). Defaults to False.
+
+        Returns:
+            The decoded model responses, in the same order as `conversations`.
+        """
+        inputs = self._prepare_inputs(conversations)
+
+        with torch.inference_mode():
+            outputs = self.model.generate(
+                **inputs,
+                do_sample=do_sample,
+                max_new_tokens=max_new_tokens,
+                use_cache=True,
+            )
+
+        # Left padding keeps every prompt the same length, so one slice drops them all
+        prompt_len = inputs["input_ids"].shape[1]
+        return [
+            text.strip()
+            for text in self.processor.batch_decode(outputs[:, prompt_len:], skip_special_tokens=True)
+        ]
 
-        outputs = self.model.generate(
-            **inputs,
-            do_sample=do_sample,
-            max_new_tokens=max_new_tokens,
+    # -------------------------------------------------------------------------
+    def _generate_stream(
+        self,
+        formatted_messages: list[dict[str, Any]],
+        max_new_tokens: int = 512,
+        do_sample: bool = False,
+    ) -> Iterator[str]:
+        """
+        Run text generation on formatted chat messages, yielding text as it is decoded.
+
+        Generation runs on a background thread that feeds a `TextIteratorStreamer`, so the
+        first chunk is available as soon as the first tokens are decoded.
+
+        Args:
+            formatted_messages: A list of formatted chat messages.
+            max_new_tokens: Maximum number of tokens to generate. Defaults to 512.
+            do_sample: Whether to enable sampling (for creativity). Defaults to False.
+
+        Yields:
+            Successive pieces of the decoded model response.
+
+        Raises:
+            Exception: Whatever `model.generate` raised on the background thread, re-raised
+                once the stream has ended.
+        """
+        inputs = self._prepare_inputs([formatted_messages])
+        streamer = TextIteratorStreamer(
+            self.processor.tokenizer, skip_prompt=True, skip_special_tokens=True
         )
 
-        return self.processor.batch_decode(outputs, skip_special_tokens=True)[0].strip()
+        error: list[BaseException] = []
+
+        def _run() -> None:
+            try:
+                # inference_mode is thread-local, so enter it on the generating thread
+                with torch.inference_mode():
+                    self.model.generate(
+                        **inputs,
+                        streamer=streamer,
+                        do_sample=do_sample,
+                        max_new_tokens=max_new_tokens,
+                        use_cache=True,
+                    )
+            except BaseException as e:
+                error.append(e)
+            finally:
+                # Unblock the consumer even if generate failed before finishing the stream
+                streamer.end()
+
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
+        if error:
+            raise error[0]
 
     # -------------------------------------------------------------------------
     def invoke(self, input: dict[str, Any]) -> dict[str, str]:
@@ -202,9 +359,74 @@ class SmolVLM2ChatModel:
         Returns:
             A list of dictionaries containing AI responses.
         """
-        results: list[dict[str, str]] = []
-        for inp in inputs:
-            formatted_messages = self._format_messages([inp])
-            response = self._generate(formatted_messages)
-            results.append({"type": "ai_message", "content": response})
-        return results
+        conversations = [self._format_messages([inp]) for inp in inputs]
+        return [
+            {"type": "ai_message", "content": response}
+            for response in self._generate_batch(conversations)
+        ]
+
+    # -------------------------------------------------------------------------
+    def stream(self, input: dict[str, Any]) -> Iterator[str]:
+        """
+        Perform a single conversational inference turn, streaming the reply.
+
+        Args:
+            input: A single message dictionary (e.g., {"role": "user", "content": "Describe the image"}).
+
+        Returns:
+            An iterator over pieces of the AI model's reply, suitable for `st.write_stream`.
+        """
+        formatted_messages = self._format_messages([input])
+        return self._generate_stream(formatted_messages)
+
+    # -------------------------------------------------------------------------
+    def unload(self) -> None:
+        """
+        Drop the model weights and processor and return freed blocks to the CUDA driver.
+
+        The wrapper cannot be used for generation afterwards. Weights are released even if
+        other objects still hold a reference to this wrapper.
+        """
+        self.__dict__.pop("model", None)
+        self.__dict__.pop("processor", None)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def __del__(self) -> None:
+        try:
+            self.unload()
+        except Exception:
+            # Interpreter shutdown may already have torn down torch
+            pass
+
+
+# -------------------------------------------------------------------------
+_model_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _load_smolvlm2(
+    model_size: Literal["small", "medium", "large"] | None,
+    quantization: Literal["none", "8bit", "4bit"],
+    device: str | None,
+) -> SmolVLM2ChatModel:
+    return SmolVLM2ChatModel(model_size=model_size, device=device, quantization=quantization)
+
+
+def get_smolvlm2(
+    model_size: Literal["small", "medium", "large"] | None = None,
+    quantization: Literal["none", "8bit", "4bit"] = "none",
+    device: str | None = None,
+) -> SmolVLM2ChatModel:
+    """Return the process-wide SmolVLM2ChatModel, loading the model on first use."""
+    with _model_lock:
+        return _load_smolvlm2(model_size, quantization, device)
+
+
+def release_smolvlm2() -> None:
+    """Forget the process-wide SmolVLM2ChatModel so the next `get_smolvlm2` call reloads it."""
+    with _model_lock:
+        _load_smolvlm2.cache_clear()
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
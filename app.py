@@ -1,14 +1,11 @@
 from pathlib import Path
-import os
-os.environ["STREAMLIT_SERVER_FILEWATCHERTYPE"] = "none"
+import shutil
 
 import streamlit as st
 
-from agents.generation_agent import get_hugface_model
-from agents.transcript_agent import VoiceToText
-from agents.video_agent import SmolVLM2ChatModel
+# The model agents pull in torch/transformers, so they are imported inside the loaders
+# below; the page renders before any of them are loaded.
 from agents.memory import MemoryManager
-from agents.langgraph_agents import build_graph
 
 # ---- PAGE CONFIG ----
 st.set_page_config(
@@ -18,37 +15,89 @@ st.set_page_config(
 )
 
 # ---- INIT MEMORY MANAGER ----
-MEMORY = MemoryManager(persist=True)
+@st.cache_resource(show_spinner=False)
+def get_memory():
+    """Open the persistent chat memory once per process instead of on every rerun."""
+    return MemoryManager(persist=True)
+
+MEMORY = get_memory()
 USER_ID = "user1"  # You can later change this per-login user
 
 # ---- SESSION STATE ----
+# Sessions and the current history are mirrored here, so reruns render without
+# querying MEMORY; the functions below keep both in sync on writes.
 if "current_session" not in st.session_state:
     st.session_state.current_session = None
+if "sessions" not in st.session_state:
+    st.session_state.sessions = MEMORY.list_sessions(USER_ID)
+if "messages" not in st.session_state:
+    st.session_state.messages = []
 
 # ---- FUNCTIONS ----
 def start_new_session():
-    session_name = f"Session {len(MEMORY.list_sessions(USER_ID)) + 1}"
+    # Name from the stored sessions, not the mirror: another tab may have added some since
+    sessions = MEMORY.list_sessions(USER_ID)
+    n = len(sessions) + 1
+    while f"Session {n}" in sessions:
+        n += 1
+    session_name = f"Session {n}"
     MEMORY.add_chat_session(USER_ID, session_name)
+    st.session_state.sessions = sessions + [session_name]
     st.session_state.current_session = session_name
+    st.session_state.messages = []
+
+def select_session(session_name):
+    st.session_state.current_session = session_name
+    st.session_state.messages = MEMORY.get_history(USER_ID, session_name)
+
+def clear_all_sessions():
+    MEMORY.remove_user(USER_ID)
+    st.session_state.sessions = []
+    st.session_state.current_session = None
+    st.session_state.messages = []
 
 def get_current_messages():
     if st.session_state.current_session:
-        return MEMORY.get_history(USER_ID, st.session_state.current_session)
+        return st.session_state.messages
     return []
 
 def add_message(role, content):
     if st.session_state.current_session:
         MEMORY.add_message(USER_ID, st.session_state.current_session, role, content)
+        st.session_state.messages.append({"role": role, "content": content})
 
 # ---- CACHE MODELS ----
+# One cache entry per model, so reloading one of them keeps the others resident
+@st.cache_resource(show_spinner=False)
+def load_llm():
+    from agents.generation_agent import get_hugface_model
+    return get_hugface_model()
+
+@st.cache_resource(show_spinner=False)
+def load_transcriber():
+    from agents.transcript_agent import get_voice_to_text
+    return get_voice_to_text()
+
+@st.cache_resource(show_spinner=False)
+def load_vlm():
+    from agents.video_agent import get_smolvlm2
+    return get_smolvlm2(model_size="medium", quantization="4bit")
+
 @st.cache_resource(show_spinner=False)
+def load_workflow():
+    from agents.langgraph_agents import get_workflow
+    return get_workflow()
+
 def load_models():
-    """Load and cache all heavy AI models."""
-    hug_llm = get_hugface_model()
-    transcript_model = VoiceToText()
-    vlm = SmolVLM2ChatModel(model_size="medium", quantization="4bit")
-    ai_workflow = build_graph()
-    return hug_llm, transcript_model, vlm, ai_workflow
+    """Load all heavy AI models, each from its own cache entry."""
+    return load_llm(), load_transcriber(), load_vlm(), load_workflow()
+
+def reload_vlm():
+    """Free the cached VLM; it is loaded again on the following rerun."""
+    from agents.video_agent import release_smolvlm2
+    load_vlm().unload()
+    load_vlm.clear()
+    release_smolvlm2()
 
 
 # ---- MAIN CONTENT ----
@@ -62,14 +111,21 @@ with st.spinner("🔄 Loading Local Models..."):
 with st.sidebar:
     st.title("💬 Chat History")
 
-    sessions = MEMORY.list_sessions(USER_ID)
+    sessions = st.session_state.sessions
     if not sessions:
         st.info("No sessions yet.")
     else:
-        for session_name in sessions:
-            if st.button(session_name, use_container_width=True):
-                st.session_state.current_session = session_name
-                st.rerun()
+        # One radio widget for all sessions instead of a button per session
+        current = st.session_state.current_session
+        selected = st.radio(
+            "Sessions",
+            sessions,
+            index=sessions.index(current) if current in sessions else None,
+            label_visibility="collapsed",
+        )
+        if selected is not None and selected != current:
+            select_session(selected)
+            st.rerun()
 
     st.divider()
 
@@ -77,9 +133,11 @@ with st.sidebar:
         start_new_session()
         st.rerun()
 
+    # Runs as a callback, before the next rerun rebinds `vlm` to a fresh model
+    st.button("♻️ Reload VLM", use_container_width=True, on_click=reload_vlm)
+
     if st.button("🗑️ Clear All History", use_container_width=True):
-        MEMORY.remove_user(USER_ID)
-        st.session_state.current_session = None
+        clear_all_sessions()
         st.rerun()
 
 # ---- MAIN LOGIC ----
@@ -94,17 +152,23 @@ else:
     if uploaded_file:
         video_file = upload_dir / uploaded_file.name
 
-        # Save the file contents
-        with open(video_file, "wb") as f:
-            f.write(uploaded_file.getbuffer())
+        # Reruns keep the same upload, so only touch the disk once per unique file
+        fingerprint = (uploaded_file.name, uploaded_file.size)
+        if st.session_state.get("_saved_fp") != fingerprint:
+            # Stream the upload to disk in 1 MB blocks
+            uploaded_file.seek(0)
+            with open(video_file, "wb") as f:
+                shutil.copyfileobj(uploaded_file, f, length=1 << 20)
+            st.session_state._saved_fp = fingerprint
+            st.session_state._saved_path = str(video_file.resolve())
+            print(st.session_state._saved_path)
 
-        st.success(f"✅ File saved successfully at: {video_file}")
-        st.write(f"Full path: `{video_file.resolve()}`")
+        video_file = st.session_state._saved_path
 
-        st.video(video_file)
+        st.success(f"✅ File saved successfully at: {upload_dir / uploaded_file.name}")
+        st.write(f"Full path: `{video_file}`")
 
-        video_file = str(video_file.resolve())
-        print(video_file)
+        st.video(video_file)
 
 
     chat_container = st.container()
@@ -136,37 +200,52 @@ else:
             "memory": MEMORY
         }
 
-        with st.spinner(text="AI is working hard for you...", show_time=True):
-            response_data = ai_workflow.invoke(
-                workflow_state
-            )
+        response_data = {}
+        streamed_pieces = []
 
-        final_response = response_data["final_response"]
+        def stream_workflow():
+            """Run the workflow, yielding the VLM reply as it is generated and keeping the final state."""
+            for mode, chunk in ai_workflow.stream(workflow_state, stream_mode=["custom", "values"]):
+                if mode == "custom":
+                    streamed_pieces.append(chunk)
+                    yield chunk
+                else:
+                    response_data.update(chunk)
 
         with chat_container:
             with st.chat_message("assistant"):
-                if response_data["report_path"] == "NA":
-                    st.text(final_response)
-                else:
+                with st.spinner(text="AI is working hard for you...", show_time=True):
+                    st.write_stream(stream_workflow())
+
+                final_response = response_data["final_response"]
+
+                # The workflow's update_memory node already stored this turn; mirror it locally
+                st.session_state.messages.extend([
+                    {"role": "Human", "content": user_input},
+                    {"role": "AI", "content": final_response},
+                ])
+
+                # Only the video agent streams; other routes (or a failed stream) show the final text
+                if "".join(streamed_pieces).strip() != final_response:
                     st.text(final_response)
 
+                if response_data["report_path"] != "NA":
                     report_file = response_data["report_path"] 
                     report_file = Path(report_file)
 
-                    with open(report_file, "rb") as f:
-                        bytes = f.read()
+                    report_bytes = report_file.read_bytes()
 
                     if report_file.suffix == ".pdf":
                         st.download_button(
                             label="📄 Download PDF",
-                            data=bytes,
+                            data=report_bytes,
                             file_name=report_file.name,
                             mime="application/pdf"
                         )
                     elif report_file.suffix == ".pptx":
                         st.download_button(
                             label="📄 Download PPTX",
-                            data=bytes,
+                            data=report_bytes,
                             file_name=report_file.name,
                             mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
                         )